@@ -1,6 +1,8 @@
 import os
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
 from dotenv import load_dotenv
 import sys
 
@@ -8,6 +10,28 @@ import sys
 env_path = os.path.join(os.path.dirname(__file__), '.env')
 load_dotenv(env_path)
 
+# Sessão compartilhada: reaproveita a conexão TCP/TLS entre as mensagens do chat
+_SESSION = requests.Session()
+_SESSION.headers.update({"Content-Type": "application/json"})
+# Novas tentativas automáticas em falhas transitórias (429/5xx), como em main2.py
+_SESSION.mount("https://", HTTPAdapter(
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.2,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["POST"]
+    )
+))
+
+def _error_message(e):
+    """Traduz uma falha de requisição em uma mensagem para o usuário."""
+    if getattr(e, 'response', None) is not None:
+        if e.response.status_code == 401:
+            return "Erro 401: Não autorizado. Verifique sua chave de API."
+        elif e.response.status_code == 404:
+            return "Erro 404: API não encontrada."
+    return f"Erro na requisição à API Gemini: {str(e)}"
+
 def chamar_gemini(prompt):
     """Envia uma requisição para a API do Google Gemini e retorna a resposta."""
     
@@ -16,10 +40,6 @@ def chamar_gemini(prompt):
         return "Erro: GEMINI_API_KEY não encontrada no arquivo .env"
 
     url = f"https://generativelanguage.googleapis.com/v1/models/gemini-pro:generateContent?key={api_key}"
-    
-    headers = {
-        "Content-Type": "application/json"
-    }
 
     data = {
         "contents": [{
@@ -30,38 +50,83 @@ def chamar_gemini(prompt):
     }
 
     try:
-        response = requests.post(url, headers=headers, json=data)
+        response = _SESSION.post(url, data=orjson.dumps(data), timeout=(3.05, 30))
         
         try:
-            resposta_json = response.json()
+            # orjson lê os bytes UTF-8 diretamente, sem decodificar o corpo para str antes
+            resposta_json = orjson.loads(response.content)
             
             if "candidates" in resposta_json:
                 return resposta_json["candidates"][0]["content"]["parts"][0]["text"]
             else:
                 return "Erro: Resposta inesperada do Gemini"
                 
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             return "Erro: Resposta inválida do servidor"
 
     except requests.exceptions.RequestException as e:
-        if hasattr(e, 'response'):
-            if e.response.status_code == 401:
-                return "Erro 401: Não autorizado. Verifique sua chave de API."
-            elif e.response.status_code == 404:
-                return "Erro 404: API não encontrada."
-        return f"Erro na requisição à API Gemini: {str(e)}"
+        return _error_message(e)
+
+def chamar_gemini_stream(prompt):
+    """Envia a requisição via streaming (SSE) e produz os trechos da resposta conforme chegam."""
+    
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        yield "Erro: GEMINI_API_KEY não encontrada no arquivo .env"
+        return
+
+    url = f"https://generativelanguage.googleapis.com/v1/models/gemini-pro:streamGenerateContent?alt=sse&key={api_key}"
+
+    data = {
+        "contents": [{
+            "parts": [{
+                "text": prompt
+            }]
+        }]
+    }
+
+    recebeu_texto = False
+    try:
+        with _SESSION.post(url, data=orjson.dumps(data), stream=True, timeout=(3.05, 30)) as response:
+            response.raise_for_status()
+
+            # Cada evento SSE chega como uma linha "data: {...}" com um pedaço da resposta
+            for line in response.iter_lines():
+                if not line.startswith(b"data: "):
+                    continue
+                candidates = orjson.loads(line[6:]).get("candidates")
+                if not candidates:
+                    continue
+                parts = candidates[0].get("content", {}).get("parts", [])
+                trecho = "".join(part.get("text", "") for part in parts)
+                if trecho:
+                    recebeu_texto = True
+                    yield trecho
+
+    except requests.exceptions.RequestException as e:
+        yield _error_message(e)
+        return
+    except orjson.JSONDecodeError:
+        yield "Erro: Resposta inválida do servidor"
+        return
+
+    if not recebeu_texto:
+        yield "Erro: Resposta inesperada do Gemini"
 
 def main():
     print("Bem-vindo ao chat com Gemini! Digite 'sair' para encerrar.")
     
     while True:
         prompt = input("\nVocê: ")
-        if prompt.lower() == 'sair':
+        if prompt.strip().lower() == 'sair':
             print("Encerrando chat...")
             break
 
-        resposta = chamar_gemini(prompt)
-        print(f"\nGemini: {resposta}")
+        # Imprime a resposta à medida que os trechos chegam, sem esperar o texto completo
+        print("\nGemini: ", end="", flush=True)
+        for trecho in chamar_gemini_stream(prompt):
+            print(trecho, end="", flush=True)
+        print()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,9 +1,14 @@
 import os
+import atexit
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
+import hashlib
+from collections import OrderedDict
 from dotenv import load_dotenv
 from enum import Enum
-from typing import Optional, List
+from typing import Optional, List, Iterator, Tuple
 import sys
 
 class GeminiModel(Enum):
@@ -31,12 +36,50 @@ class GeminiAPI:
     def __init__(self, api_key: str):
         self.api_key = api_key
         self.config = GeminiConfig()
+        # Sessão reutilizada entre chamadas (keep-alive e pool de conexões)
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+        # Pool maior e novas tentativas automáticas em falhas transitórias (429/5xx)
+        retry = Retry(
+            total=3,
+            backoff_factor=0.2,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["POST"]
+        )
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=retry)
+        self.session.mount("https://", adapter)
+        # Cache LRU de respostas para prompts determinísticos (temperatura 0)
+        self._cache = OrderedDict()
+        self._cache_max = 256
+        # generationConfig montado uma vez e invalidado em update_config
+        self._gen_config_cache: Optional[dict] = None
     
     def update_config(self, **kwargs):
         """Atualiza as configurações do modelo."""
         for key, value in kwargs.items():
             if hasattr(self.config, key):
                 setattr(self.config, key, value)
+        self._gen_config_cache = None
+
+    def _generation_config(self) -> dict:
+        """Retorna o generationConfig atual, montando-o apenas após mudanças na configuração."""
+        if self._gen_config_cache is None:
+            generation_config = {
+                "temperature": self.config.temperature,
+            }
+
+            # Adiciona configurações opcionais apenas se estiverem definidas
+            if self.config.top_k is not None:
+                generation_config["topK"] = self.config.top_k
+            if self.config.top_p is not None:
+                generation_config["topP"] = self.config.top_p
+            if self.config.max_output_tokens is not None:
+                generation_config["maxOutputTokens"] = self.config.max_output_tokens
+            if self.config.stop_sequences:
+                generation_config["stopSequences"] = self.config.stop_sequences
+
+            self._gen_config_cache = generation_config
+        return self._gen_config_cache
 
     def build_request_data(self, prompt: str) -> dict:
         """Constrói o payload da requisição com as configurações atuais."""
@@ -46,132 +89,223 @@ class GeminiAPI:
                     "text": prompt
                 }]
             }],
-            "generationConfig": {
-                "temperature": self.config.temperature,
-            }
+            "generationConfig": self._generation_config()
         }
 
-        # Adiciona configurações opcionais apenas se estiverem definidas
-        if self.config.top_k is not None:
-            data["generationConfig"]["topK"] = self.config.top_k
-        
-        if self.config.top_p is not None:
-            data["generationConfig"]["topP"] = self.config.top_p
-            
-        if self.config.max_output_tokens is not None:
-            data["generationConfig"]["maxOutputTokens"] = self.config.max_output_tokens
-            
-        if self.config.stop_sequences:
-            data["generationConfig"]["stopSequences"] = self.config.stop_sequences
-
         return data
 
+    def _cache_key(self, data: dict) -> bytes:
+        """Gera a chave do cache a partir do modelo e do payload completo."""
+        payload = orjson.dumps({"model": self.config.model.value, "data": data}, option=orjson.OPT_SORT_KEYS)
+        return hashlib.sha256(payload).digest()
+
+    def _cache_store(self, key: bytes, resposta: str):
+        """Guarda a resposta no cache, descartando a entrada mais antiga se necessário."""
+        self._cache[key] = resposta
+        if len(self._cache) > self._cache_max:
+            self._cache.popitem(last=False)
+
+    def _cache_lookup(self, data: dict) -> Tuple[Optional[bytes], Optional[str]]:
+        """Retorna a chave do cache e a resposta já armazenada, se houver."""
+        # Só respostas determinísticas (temperatura 0) podem ser reaproveitadas
+        if self.config.temperature != 0:
+            return None, None
+        key = self._cache_key(data)
+        resposta = self._cache.get(key)
+        if resposta is not None:
+            self._cache.move_to_end(key)
+        return key, resposta
+
+    @staticmethod
+    def _error_message(e: requests.exceptions.RequestException) -> str:
+        """Traduz uma falha de requisição em uma mensagem para o usuário."""
+        if getattr(e, 'response', None) is not None:
+            if e.response.status_code == 401:
+                return "Erro 401: Não autorizado. Verifique sua chave de API."
+            elif e.response.status_code == 404:
+                return "Erro 404: API não encontrada."
+        return f"Erro na requisição à API Gemini: {str(e)}"
+
     def chamar_gemini(self, prompt: str) -> str:
         """Envia uma requisição para a API do Google Gemini e retorna a resposta."""
         if not self.api_key:
             return "Erro: GEMINI_API_KEY não encontrada"
 
         url = f"https://generativelanguage.googleapis.com/v1/models/{self.config.model.value}:generateContent?key={self.api_key}"
-        
-        headers = {
-            "Content-Type": "application/json"
-        }
 
         data = self.build_request_data(prompt)
 
+        cache_key, cached = self._cache_lookup(data)
+        if cached is not None:
+            return cached
+
         try:
-            response = requests.post(url, headers=headers, json=data)
+            response = self.session.post(url, data=orjson.dumps(data), timeout=(3.05, 30))
             response.raise_for_status()
             
-            resposta_json = response.json()
+            resposta_json = orjson.loads(response.content)
             
             if "candidates" in resposta_json:
-                return resposta_json["candidates"][0]["content"]["parts"][0]["text"]
+                resposta = resposta_json["candidates"][0]["content"]["parts"][0]["text"]
+                if cache_key is not None:
+                    self._cache_store(cache_key, resposta)
+                return resposta
             else:
                 return "Erro: Resposta inesperada do Gemini"
                 
         except requests.exceptions.RequestException as e:
-            if hasattr(e, 'response'):
-                if e.response.status_code == 401:
-                    return "Erro 401: Não autorizado. Verifique sua chave de API."
-                elif e.response.status_code == 404:
-                    return "Erro 404: API não encontrada."
-            return f"Erro na requisição à API Gemini: {str(e)}"
-        except json.JSONDecodeError:
+            return self._error_message(e)
+        except orjson.JSONDecodeError:
             return "Erro: Resposta inválida do servidor"
 
+    def chamar_gemini_stream(self, prompt: str) -> Iterator[str]:
+        """Envia a requisição via streaming (SSE) e produz os trechos da resposta conforme chegam."""
+        if not self.api_key:
+            yield "Erro: GEMINI_API_KEY não encontrada"
+            return
+
+        url = f"https://generativelanguage.googleapis.com/v1/models/{self.config.model.value}:streamGenerateContent?alt=sse&key={self.api_key}"
+
+        data = self.build_request_data(prompt)
+
+        cache_key, cached = self._cache_lookup(data)
+        if cached is not None:
+            yield cached
+            return
+
+        trechos = []
+        try:
+            with self.session.post(url, data=orjson.dumps(data), stream=True, timeout=(3.05, 30)) as response:
+                response.raise_for_status()
+
+                # Cada evento SSE chega como uma linha "data: {...}" com um pedaço da resposta
+                for line in response.iter_lines():
+                    if not line.startswith(b"data: "):
+                        continue
+                    candidates = orjson.loads(line[6:]).get("candidates")
+                    if not candidates:
+                        continue
+                    parts = candidates[0].get("content", {}).get("parts", [])
+                    trecho = "".join(part.get("text", "") for part in parts)
+                    if trecho:
+                        trechos.append(trecho)
+                        yield trecho
+
+        except requests.exceptions.RequestException as e:
+            yield self._error_message(e)
+            return
+        except orjson.JSONDecodeError:
+            yield "Erro: Resposta inválida do servidor"
+            return
+
+        if not trechos:
+            yield "Erro: Resposta inesperada do Gemini"
+        elif cache_key is not None:
+            self._cache_store(cache_key, "".join(trechos))
+
+# Instância compartilhada no processo: o pool de conexões da sessão é reaproveitado
+_API_SINGLETON: Optional[GeminiAPI] = None
+
+def get_api() -> GeminiAPI:
+    """Retorna a instância compartilhada da API, criando-a na primeira chamada."""
+    global _API_SINGLETON
+    if _API_SINGLETON is None:
+        # Carrega as variáveis de ambiente do arquivo .env
+        env_path = os.path.join(os.path.dirname(__file__), '.env')
+        load_dotenv(env_path)
+        _API_SINGLETON = GeminiAPI(os.getenv("GEMINI_API_KEY"))
+    return _API_SINGLETON
+
+@atexit.register
+def _close_api():
+    """Fecha a sessão HTTP compartilhada ao encerrar o processo."""
+    if _API_SINGLETON is not None:
+        _API_SINGLETON.session.close()
+
+def handle_exit(api: GeminiAPI) -> bool:
+    """Encerra o chat."""
+    print("Encerrando chat...")
+    return False
+
+def handle_config(api: GeminiAPI) -> bool:
+    """Exibe e altera as configurações do modelo."""
+    print("\nConfigurações atuais:")
+    print(f"Modelo: {api.config.model.value}")
+    print(f"Temperatura: {api.config.temperature}")
+    print(f"Top K: {api.config.top_k}")
+    print(f"Top P: {api.config.top_p}")
+    print(f"Max Output Tokens: {api.config.max_output_tokens}")
+    print(f"Stop Sequences: {api.config.stop_sequences}")
+
+    # Menu de configuração
+    print("\nO que você deseja configurar?")
+    print("1. Modelo (gemini-pro, gemini-pro-vision)")
+    print("2. Temperatura (0.0 a 1.0)")
+    print("3. Top K")
+    print("4. Top P")
+    print("5. Max Output Tokens")
+    print("6. Stop Sequences")
+    print("7. Voltar ao chat")
+
+    opcao = input("\nEscolha uma opção (1-7): ")
+
+    if opcao == "1":
+        print("\nModelos disponíveis:")
+        for model in GeminiModel:
+            print(f"- {model.value}")
+        modelo = input("Digite o nome do modelo: ")
+        try:
+            api.update_config(model=GeminiModel(modelo))
+        except ValueError:
+            print("Modelo inválido!")
+
+    elif opcao == "2":
+        temp = float(input("Digite a temperatura (0.0 a 1.0): "))
+        api.update_config(temperature=temp)
+
+    elif opcao == "3":
+        top_k = int(input("Digite o valor de Top K (ou 0 para desativar): "))
+        api.update_config(top_k=top_k if top_k > 0 else None)
+
+    elif opcao == "4":
+        top_p = float(input("Digite o valor de Top P (ou 0 para desativar): "))
+        api.update_config(top_p=top_p if top_p > 0 else None)
+
+    elif opcao == "5":
+        max_tokens = int(input("Digite o número máximo de tokens (ou 0 para desativar): "))
+        api.update_config(max_output_tokens=max_tokens if max_tokens > 0 else None)
+
+    elif opcao == "6":
+        sequences = input("Digite as sequências de parada separadas por vírgula (ou enter para limpar): ")
+        api.update_config(stop_sequences=sequences.split(",") if sequences.strip() else [])
+
+    return True
+
+# Comandos do chat; qualquer outra entrada é enviada ao Gemini sem alterações
+COMMANDS = {
+    "sair": handle_exit,
+    "config": handle_config,
+}
+
 def main():
-    # Carrega as variáveis de ambiente do arquivo .env
-    env_path = os.path.join(os.path.dirname(__file__), '.env')
-    load_dotenv(env_path)
-    
-    # Inicializa a API com a chave
-    api = GeminiAPI(os.getenv("GEMINI_API_KEY"))
+    # Reutiliza a API (e suas conexões) já criada neste processo
+    api = get_api()
     
     print("Bem-vindo ao chat com Gemini! Digite 'config' para alterar configurações ou 'sair' para encerrar.")
     
     while True:
         prompt = input("\nVocê: ")
-        
-        if prompt.lower() == 'sair':
-            print("Encerrando chat...")
-            break
-            
-        elif prompt.lower() == 'config':
-            print("\nConfigurações atuais:")
-            print(f"Modelo: {api.config.model.value}")
-            print(f"Temperatura: {api.config.temperature}")
-            print(f"Top K: {api.config.top_k}")
-            print(f"Top P: {api.config.top_p}")
-            print(f"Max Output Tokens: {api.config.max_output_tokens}")
-            print(f"Stop Sequences: {api.config.stop_sequences}")
-            
-            # Menu de configuração
-            print("\nO que você deseja configurar?")
-            print("1. Modelo (gemini-pro, gemini-pro-vision)")
-            print("2. Temperatura (0.0 a 1.0)")
-            print("3. Top K")
-            print("4. Top P")
-            print("5. Max Output Tokens")
-            print("6. Stop Sequences")
-            print("7. Voltar ao chat")
-            
-            opcao = input("\nEscolha uma opção (1-7): ")
-            
-            if opcao == "1":
-                print("\nModelos disponíveis:")
-                for model in GeminiModel:
-                    print(f"- {model.value}")
-                modelo = input("Digite o nome do modelo: ")
-                try:
-                    api.update_config(model=GeminiModel(modelo))
-                except ValueError:
-                    print("Modelo inválido!")
-                    
-            elif opcao == "2":
-                temp = float(input("Digite a temperatura (0.0 a 1.0): "))
-                api.update_config(temperature=temp)
-                
-            elif opcao == "3":
-                top_k = int(input("Digite o valor de Top K (ou 0 para desativar): "))
-                api.update_config(top_k=top_k if top_k > 0 else None)
-                
-            elif opcao == "4":
-                top_p = float(input("Digite o valor de Top P (ou 0 para desativar): "))
-                api.update_config(top_p=top_p if top_p > 0 else None)
-                
-            elif opcao == "5":
-                max_tokens = int(input("Digite o número máximo de tokens (ou 0 para desativar): "))
-                api.update_config(max_output_tokens=max_tokens if max_tokens > 0 else None)
-                
-            elif opcao == "6":
-                sequences = input("Digite as sequências de parada separadas por vírgula (ou enter para limpar): ")
-                api.update_config(stop_sequences=sequences.split(",") if sequences.strip() else [])
-            
+
+        handler = COMMANDS.get(prompt.strip().lower())
+        if handler is not None:
+            if not handler(api):
+                break
             continue
 
-        resposta = api.chamar_gemini(prompt)
-        print(f"\nGemini: {resposta}")
+        print("\nGemini: ", end="", flush=True)
+        for trecho in api.chamar_gemini_stream(prompt):
+            print(trecho, end="", flush=True)
+        print()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
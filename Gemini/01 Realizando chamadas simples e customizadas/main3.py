@@ -1,33 +1,81 @@
 import os
-import requests
-import json
+import asyncio
+import httpx
+import orjson
+import hashlib
+from collections import OrderedDict
 import base64
+import uuid
+import mmap
+import time
+import re
+import codecs
 from dotenv import load_dotenv
 from enum import Enum
-from typing import Optional, List, Union, BinaryIO
+from typing import Optional, List, Union, BinaryIO, AsyncIterator, Tuple
 from pathlib import Path
 import mimetypes
-import markdown
 import pygments
 from pygments import highlight
 from pygments.formatters import HtmlFormatter
 from pygments.lexers import get_lexer_by_name, guess_lexer
-from bs4 import BeautifulSoup
+import lxml.html
 import tempfile
 from PIL import Image
 import io
+from functools import lru_cache
 
 # Importação condicional do PyMuPDF
 try:
     import fitz  # PyMuPDF
     PDF_SUPPORT = True
+    # Flags padrão do modo "text" (inclui o código CID para glifos sem Unicode)
+    PDF_TEXT_FLAGS = fitz.TEXTFLAGS_TEXT
 except ImportError:
     PDF_SUPPORT = False
     print("Aviso: Suporte a PDF não está disponível. Para habilitar, instale PyMuPDF.")
 
+# Markdown: cmarkgfm (binding C do cmark do GitHub) com markdown-it-py como alternativa
+try:
+    import cmarkgfm
+    _MD = None
+except ImportError:
+    from markdown_it import MarkdownIt
+    cmarkgfm = None
+    # Mesmas extensões GFM (tabelas, tachado) do cmarkgfm, mantendo HTML bruto
+    _MD = MarkdownIt("commonmark").enable(["table", "strikethrough"])
+
+# Imagens nesses formatos, dentro do limite de tamanho, são enviadas sem recodificação
+PASSTHROUGH_FORMATS = ("JPEG", "PNG")
+PASSTHROUGH_MAX_BYTES = 4 * 1024 * 1024
+
+# Inicializa a base de tipos MIME e o formatador de código uma única vez
+mimetypes.init()
+_FORMATTER = HtmlFormatter(style='monokai', linenos=True)
+# Parser HTML em C (libxml2); descartar espaços vazios permite reindentar a saída
+_HTML_PARSER = lxml.html.HTMLParser(remove_blank_text=True)
+# Declaração de charset nos primeiros 1024 bytes (janela de pré-leitura do HTML) ou BOM
+_HTML_CHARSET_RE = re.compile(rb'<meta[^>]+charset', re.IGNORECASE)
+# Encoding do cabeçalho XML de arquivos XHTML, que o parser HTML do lxml não lê
+_XML_ENCODING_RE = re.compile(rb'^\s*<\?xml[^>]+encoding\s*=\s*["\']([\w.:-]+)', re.IGNORECASE)
+# O lxml recusa str com declaração XML de encoding; em texto já decodificado ela não serve
+_XML_DECLARATION_RE = re.compile(r'^\s*<\?xml[^>]*\?>')
+_HTML_BOMS = (codecs.BOM_UTF8, codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)
+
+@lru_cache(maxsize=32)
+def _lexer(name: str):
+    """Retorna o lexer do Pygments para a linguagem, reaproveitando instâncias já criadas."""
+    return get_lexer_by_name(name)
+
 class GeminiModel(Enum):
     GEMINI_PRO = "gemini-pro"
     GEMINI_PRO_VISION = "gemini-pro-vision"
+    GEMINI_1_5_FLASH = "gemini-1.5-flash-001"
+
+# cachedContents só aceita versões fixas de modelos; os aliases sem versão não são aceitos
+CACHE_SUPPORTED_MODELS = (GeminiModel.GEMINI_1_5_FLASH,)
+# O cache de contexto do Gemini exige um mínimo de tokens (~4 caracteres por token)
+CACHE_MIN_CHARS = 32768 * 4
 
 class ContentType(Enum):
     TEXT = "text"
@@ -55,32 +103,59 @@ class GeminiConfig:
         self.stop_sequences = stop_sequences or []
 
 class MediaHandler:
+    @staticmethod
+    def read_file(file_path: str, encoding: Optional[str] = 'utf-8') -> Union[str, bytes]:
+        """Lê o arquivo como texto (decodificado direto de um mmap) ou como bytes crus se encoding=None."""
+        with open(file_path, 'rb') as f:
+            if encoding is None:
+                return f.read()
+            # mmap não aceita arquivos vazios
+            if os.fstat(f.fileno()).st_size == 0:
+                return ""
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                text = str(mm, encoding)
+        # Mesma normalização de quebras de linha do open() em modo texto
+        return text.replace("\r\n", "\n").replace("\r", "\n")
+
     @staticmethod
     def process_image(image_path: Union[str, BinaryIO]) -> dict:
         """Processa imagem para envio à API."""
         try:
+            mime_type = "image/jpeg"
             if isinstance(image_path, str):
+                max_size = 2048
                 with Image.open(image_path) as img:
-                    # Converter para RGB se necessário
-                    if img.mode != 'RGB':
-                        img = img.convert('RGB')
-                    # Redimensionar se a imagem for muito grande
-                    max_size = 2048
-                    if max(img.size) > max_size:
-                        ratio = max_size / max(img.size)
-                        new_size = tuple(int(dim * ratio) for dim in img.size)
-                        img = img.resize(new_size, Image.Resampling.LANCZOS)
-                    
-                    # Converter para bytes
-                    img_byte_arr = io.BytesIO()
-                    img.save(img_byte_arr, format='JPEG', quality=85)
-                    img_bytes = img_byte_arr.getvalue()
+                    # Imagens JPEG/PNG já dentro dos limites seguem sem decodificar e recodificar
+                    if (
+                        img.format in PASSTHROUGH_FORMATS
+                        and img.mode == 'RGB'
+                        and max(img.size) <= max_size
+                        and os.path.getsize(image_path) <= PASSTHROUGH_MAX_BYTES
+                    ):
+                        mime_type = Image.MIME[img.format]
+                        with open(image_path, 'rb') as f:
+                            img_bytes = f.read()
+                    else:
+                        # Converter para RGB se necessário
+                        if img.mode != 'RGB':
+                            img = img.convert('RGB')
+                        # Redimensionar se a imagem for muito grande
+                        if max(img.size) > max_size:
+                            ratio = max_size / max(img.size)
+                            new_size = tuple(int(dim * ratio) for dim in img.size)
+                            img = img.resize(new_size, Image.Resampling.LANCZOS)
+
+                        # Converter para bytes
+                        img_byte_arr = io.BytesIO()
+                        img.save(img_byte_arr, format='JPEG', quality=85)
+                        img_bytes = img_byte_arr.getvalue()
             else:
                 img_bytes = image_path.read()
 
             return {
-                "mime_type": "image/jpeg",
-                "data": base64.b64encode(img_bytes).decode('utf-8')
+                "mime_type": mime_type,
+                # Mantido em bytes: é inserido direto no corpo JSON por _dumps_payload
+                "data": base64.b64encode(img_bytes)
             }
         except Exception as e:
             raise ValueError(f"Erro ao processar imagem: {str(e)}")
@@ -91,11 +166,11 @@ class MediaHandler:
         if not PDF_SUPPORT:
             raise ValueError("Suporte a PDF não está disponível. Instale PyMuPDF para habilitar.")
         
-        text_content = []
         try:
             with fitz.open(pdf_path) as doc:
-                for page in doc:
-                    text_content.append(page.get_text())
+                text_content = [None] * doc.page_count
+                for i in range(doc.page_count):
+                    text_content[i] = doc[i].get_text("text", flags=PDF_TEXT_FLAGS)
             return "\n".join(text_content)
         except Exception as e:
             raise ValueError(f"Erro ao processar PDF: {str(e)}")
@@ -104,7 +179,12 @@ class MediaHandler:
     def process_markdown(markdown_text: str) -> str:
         """Converte markdown para HTML."""
         try:
-            return markdown.markdown(markdown_text)
+            if cmarkgfm is not None:
+                # CMARK_OPT_UNSAFE preserva o HTML bruto do arquivo, como o renderizador anterior
+                return cmarkgfm.github_flavored_markdown_to_html(
+                    markdown_text, options=cmarkgfm.Options.CMARK_OPT_UNSAFE
+                )
+            return _MD.render(markdown_text)
         except Exception as e:
             raise ValueError(f"Erro ao processar Markdown: {str(e)}")
 
@@ -113,20 +193,33 @@ class MediaHandler:
         """Aplica syntax highlighting ao código."""
         try:
             if language:
-                lexer = get_lexer_by_name(language)
+                lexer = _lexer(language)
             else:
                 lexer = guess_lexer(code)
-            formatter = HtmlFormatter(style='monokai', linenos=True)
-            return highlight(code, lexer, formatter)
+            return highlight(code, lexer, _FORMATTER)
         except Exception as e:
             raise ValueError(f"Erro ao processar código: {str(e)}")
 
     @staticmethod
-    def process_html(html_content: str) -> str:
+    def process_html(html_content: Union[str, bytes]) -> str:
         """Processa e limpa HTML."""
         try:
-            soup = BeautifulSoup(html_content, 'html.parser')
-            return soup.prettify()
+            # Bytes seguem crus quando o documento declara o próprio charset; o XHTML é
+            # decodificado pelo encoding do cabeçalho XML e, sem declaração, como UTF-8
+            # (o libxml2 assumiria latin-1)
+            if isinstance(html_content, bytes):
+                head = html_content[:1024]
+                if not (head.startswith(_HTML_BOMS) or _HTML_CHARSET_RE.search(head)):
+                    xml_encoding = _XML_ENCODING_RE.match(head)
+                    encoding = xml_encoding.group(1).decode('ascii') if xml_encoding else 'utf-8'
+                    html_content = html_content.decode(encoding)
+            if isinstance(html_content, str):
+                html_content = _XML_DECLARATION_RE.sub('', html_content, count=1)
+            # O lxml rejeita documentos vazios; o BeautifulSoup devolvia texto vazio
+            if not html_content.strip():
+                return ""
+            root = lxml.html.fromstring(html_content, parser=_HTML_PARSER)
+            return lxml.html.tostring(root, pretty_print=True, encoding='unicode')
         except Exception as e:
             raise ValueError(f"Erro ao processar HTML: {str(e)}")
 
@@ -134,13 +227,130 @@ class GeminiAPI:
     def __init__(self, api_key: str):
         self.api_key = api_key
         self.config = GeminiConfig()
+        # Cliente assíncrono com HTTP/2: as requisições compartilham uma única
+        # conexão TCP/TLS multiplexada sem bloquear o event loop
+        self.client = httpx.AsyncClient(
+            http2=True,
+            headers={"Content-Type": "application/json"},
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=40),
+            timeout=httpx.Timeout(30, connect=3.05)
+        )
         self.media_handler = MediaHandler()
+        # Cache LRU de respostas para prompts determinísticos (temperatura 0)
+        self._cache = OrderedDict()
+        self._cache_max = 256
+        # generationConfig montado uma vez e invalidado em update_config
+        self._gen_config_cache: Optional[dict] = None
+        # Nome do contexto em cache no servidor (cachedContents), quando houver,
+        # com o modelo para o qual foi criado e o texto do documento armazenado
+        self.cached_content_name: Optional[str] = None
+        self._cached_content_model: Optional[GeminiModel] = None
+        self._cached_content_expires_at: Optional[float] = None
+        self._cached_prefix: Optional[str] = None
+
+    async def aclose(self):
+        """Encerra o cliente HTTP e libera as conexões abertas."""
+        await self.delete_cache()
+        await self.client.aclose()
+
+    async def ensure_connection(self):
+        """Estabelece a conexão TLS com a API antecipadamente, para a próxima requisição já encontrá-la aberta."""
+        if not self.api_key:
+            return
+
+        url = f"https://generativelanguage.googleapis.com/v1/models/{self.config.model.value}?key={self.api_key}"
+        try:
+            await self.client.get(url)
+        except httpx.HTTPError:
+            pass
+
+    async def create_cache(self, prefix_text: str, ttl_seconds: int = 3600) -> bool:
+        """Armazena um prefixo estático (ex.: texto de um PDF) no cache de contexto do servidor."""
+        if self.config.model not in CACHE_SUPPORTED_MODELS:
+            return False
+
+        await self.delete_cache()
+
+        url = f"https://generativelanguage.googleapis.com/v1beta/cachedContents?key={self.api_key}"
+        data = {
+            "model": f"models/{self.config.model.value}",
+            "contents": [{
+                "role": "user",
+                "parts": [{"text": prefix_text}]
+            }],
+            "ttl": f"{ttl_seconds}s"
+        }
+
+        try:
+            response = await self.client.post(url, content=orjson.dumps(data))
+            response.raise_for_status()
+            self.cached_content_name = orjson.loads(response.content)["name"]
+            self._cached_content_model = self.config.model
+            # Margem de segurança para não referenciar um cache prestes a expirar
+            self._cached_content_expires_at = time.monotonic() + ttl_seconds - 60
+            self._cached_prefix = prefix_text
+            return True
+        except (httpx.HTTPError, KeyError, orjson.JSONDecodeError):
+            return False
+
+    async def delete_cache(self):
+        """Descarta o documento em cache, inclusive o contexto armazenado no servidor."""
+        self._cached_prefix = None
+        await self._drop_cached_content()
+
+    async def _drop_cached_content(self):
+        """Remove o contexto no servidor; o texto do documento continua disponível para envio inline."""
+        name = self.cached_content_name
+        self._forget_cached_content()
+        if not name:
+            return
+
+        url = f"https://generativelanguage.googleapis.com/v1beta/{name}?key={self.api_key}"
+        try:
+            await self.client.delete(url)
+        except httpx.HTTPError:
+            pass
+
+    def _forget_cached_content(self):
+        """Esquece a referência ao contexto no servidor sem apagá-lo."""
+        self.cached_content_name = None
+        self._cached_content_model = None
+        self._cached_content_expires_at = None
+
+    def _cached_content_usable(self) -> bool:
+        """Indica se o contexto no servidor ainda vale para o modelo atual e não expirou."""
+        return (
+            self.cached_content_name is not None
+            and self._cached_content_model == self.config.model
+            and time.monotonic() < self._cached_content_expires_at
+        )
 
     def update_config(self, **kwargs):
         """Atualiza as configurações do modelo."""
         for key, value in kwargs.items():
             if hasattr(self.config, key):
                 setattr(self.config, key, value)
+        self._gen_config_cache = None
+
+    def _generation_config(self) -> dict:
+        """Retorna o generationConfig atual, montando-o apenas após mudanças na configuração."""
+        if self._gen_config_cache is None:
+            generation_config = {
+                "temperature": self.config.temperature,
+            }
+
+            # Adiciona configurações opcionais apenas se estiverem definidas
+            if self.config.top_k is not None:
+                generation_config["topK"] = self.config.top_k
+            if self.config.top_p is not None:
+                generation_config["topP"] = self.config.top_p
+            if self.config.max_output_tokens is not None:
+                generation_config["maxOutputTokens"] = self.config.max_output_tokens
+            if self.config.stop_sequences:
+                generation_config["stopSequences"] = self.config.stop_sequences
+
+            self._gen_config_cache = generation_config
+        return self._gen_config_cache
 
     def build_request_data(self, content: Union[str, dict, list], content_type: ContentType = ContentType.TEXT) -> dict:
         """Constrói o payload da requisição com base no tipo de conteúdo."""
@@ -148,21 +358,9 @@ class GeminiAPI:
             "contents": [{
                 "parts": []
             }],
-            "generationConfig": {
-                "temperature": self.config.temperature,
-            }
+            "generationConfig": self._generation_config()
         }
 
-        # Adiciona configurações opcionais
-        if self.config.top_k is not None:
-            data["generationConfig"]["topK"] = self.config.top_k
-        if self.config.top_p is not None:
-            data["generationConfig"]["topP"] = self.config.top_p
-        if self.config.max_output_tokens is not None:
-            data["generationConfig"]["maxOutputTokens"] = self.config.max_output_tokens
-        if self.config.stop_sequences:
-            data["generationConfig"]["stopSequences"] = self.config.stop_sequences
-
         # Processa o conteúdo com base no tipo
         if content_type == ContentType.IMAGE:
             self.config.model = GeminiModel.GEMINI_PRO_VISION
@@ -175,11 +373,35 @@ class GeminiAPI:
                 })
             else:
                 raise ValueError("Conteúdo de imagem inválido")
+        elif isinstance(content, list):
+            # Partes já montadas (vários arquivos enviados em uma única requisição)
+            if any("inline_data" in part for part in content):
+                self.config.model = GeminiModel.GEMINI_PRO_VISION
+            data["contents"][0]["parts"].extend(content)
         else:
             data["contents"][0]["parts"].append({"text": str(content)})
 
+        if self._cached_prefix is not None:
+            if self._cached_content_usable():
+                # Referencia o prefixo já armazenado no servidor em vez de reenviá-lo
+                data["cachedContent"] = self.cached_content_name
+            else:
+                # O cache expirou, foi rejeitado ou pertence a outro modelo: o documento segue inline
+                data["contents"][0]["parts"].insert(0, {"text": self._cached_prefix})
+
         return data
 
+    @staticmethod
+    def build_parts(prompt: str, items: List[Union[str, dict]]) -> list:
+        """Junta o prompt e o conteúdo de vários arquivos em uma única lista de partes."""
+        parts = [{"text": prompt}]
+        for item in items:
+            if isinstance(item, dict) and item.get("type") == "image":
+                parts.append({"inline_data": item["image_data"]})
+            else:
+                parts.append({"text": str(item)})
+        return parts
+
     async def process_file(self, file_path: str, content_type: Optional[ContentType] = None) -> Union[str, dict]:
         """Processa diferentes tipos de arquivo."""
         if not content_type:
@@ -196,166 +418,395 @@ class GeminiAPI:
                 else:
                     content_type = ContentType.TEXT
 
+        # Leitura e processamento rodam em threads para não bloquear o event loop
         try:
             if content_type == ContentType.IMAGE:
-                image_data = self.media_handler.process_image(file_path)
+                image_data = await asyncio.to_thread(self.media_handler.process_image, file_path)
                 return {
                     "type": "image",
                     "image_data": image_data
                 }
             elif content_type == ContentType.PDF:
-                return self.media_handler.process_pdf(file_path)
+                return await asyncio.to_thread(self.media_handler.process_pdf, file_path)
             elif content_type == ContentType.MARKDOWN:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    return self.media_handler.process_markdown(f.read())
+                text = await asyncio.to_thread(self.media_handler.read_file, file_path)
+                return await asyncio.to_thread(self.media_handler.process_markdown, text)
             elif content_type == ContentType.HTML:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    return self.media_handler.process_html(f.read())
+                # Bytes crus: o lxml respeita o charset declarado pelo documento
+                html_bytes = await asyncio.to_thread(self.media_handler.read_file, file_path, None)
+                return await asyncio.to_thread(self.media_handler.process_html, html_bytes)
             elif content_type == ContentType.CODE:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    extension = Path(file_path).suffix[1:]
-                    return self.media_handler.process_code(f.read(), extension)
+                text = await asyncio.to_thread(self.media_handler.read_file, file_path)
+                extension = Path(file_path).suffix[1:]
+                return await asyncio.to_thread(self.media_handler.process_code, text, extension)
             else:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    return f.read()
+                return await asyncio.to_thread(self.media_handler.read_file, file_path)
         except Exception as e:
             raise ValueError(f"Erro ao processar arquivo: {str(e)}")
 
+    @staticmethod
+    def _dumps_payload(data: dict) -> bytes:
+        """Serializa o payload, inserindo o base64 das imagens diretamente nos bytes do corpo."""
+        images = []
+        parts = []
+        marker = uuid.uuid4().hex
+        for part in data["contents"][0]["parts"]:
+            inline_data = part.get("inline_data")
+            if inline_data is not None and isinstance(inline_data["data"], bytes):
+                placeholder = f"__inline_data_{marker}_{len(images)}__"
+                images.append((f'"{placeholder}"'.encode(), inline_data["data"]))
+                part = {"inline_data": {**inline_data, "data": placeholder}}
+            parts.append(part)
+
+        if not images:
+            return orjson.dumps(data)
+
+        body = orjson.dumps({**data, "contents": [{**data["contents"][0], "parts": parts}]})
+
+        # O alfabeto do base64 não precisa de escape em JSON, então os bytes entram como estão.
+        # Os marcadores aparecem na ordem das partes: o corpo é percorrido uma vez, em fatias
+        # de um memoryview, e copiado uma única vez no join final
+        view = memoryview(body)
+        chunks = []
+        pos = 0
+        for placeholder, encoded in images:
+            start = body.find(placeholder, pos)
+            chunks.extend((view[pos:start], b'"', encoded, b'"'))
+            pos = start + len(placeholder)
+        chunks.append(view[pos:])
+        return b"".join(chunks)
+
+    def _cache_key(self, body: bytes) -> bytes:
+        """Gera a chave do cache a partir do modelo e do corpo serializado da requisição."""
+        return hashlib.sha256(self.config.model.value.encode("utf-8") + b"\0" + body).digest()
+
+    def _cache_store(self, key: bytes, resposta: str):
+        """Guarda a resposta no cache, descartando a entrada mais antiga se necessário."""
+        self._cache[key] = resposta
+        if len(self._cache) > self._cache_max:
+            self._cache.popitem(last=False)
+
+    def _cache_lookup(self, body: bytes) -> Tuple[Optional[bytes], Optional[str]]:
+        """Retorna a chave do cache e a resposta já armazenada, se houver."""
+        # Só respostas determinísticas (temperatura 0) podem ser reaproveitadas
+        if self.config.temperature != 0:
+            return None, None
+        key = self._cache_key(body)
+        resposta = self._cache.get(key)
+        if resposta is not None:
+            self._cache.move_to_end(key)
+        return key, resposta
+
+    def _build_url(self, data: dict, method: str) -> str:
+        """Monta a URL do método de geração para o modelo atual."""
+        # cachedContent só está disponível na versão v1beta da API
+        api_version = "v1beta" if "cachedContent" in data else "v1"
+        url = f"https://generativelanguage.googleapis.com/{api_version}/models/{self.config.model.value}:{method}"
+        if method == "streamGenerateContent":
+            return f"{url}?alt=sse&key={self.api_key}"
+        return f"{url}?key={self.api_key}"
+
+    @staticmethod
+    def _error_message(e: httpx.HTTPError) -> str:
+        """Traduz uma falha de requisição em uma mensagem para o usuário."""
+        if isinstance(e, httpx.HTTPStatusError):
+            if e.response.status_code == 401:
+                return "Erro 401: Não autorizado. Verifique sua chave de API."
+            elif e.response.status_code == 404:
+                return "Erro 404: API não encontrada."
+        return f"Erro na requisição à API Gemini: {str(e)}"
+
+    @staticmethod
+    def _cached_content_rejected(e: httpx.HTTPError, data: dict) -> bool:
+        """Indica se a falha se deve ao contexto em cache referenciado na requisição."""
+        if "cachedContent" not in data or not isinstance(e, httpx.HTTPStatusError):
+            return False
+        if e.response.status_code in (403, 404):
+            return True
+        if e.response.status_code != 400:
+            return False
+
+        # Um 400 qualquer (ex.: parâmetro inválido) não diz nada sobre o cache; só vale se a mensagem o citar
+        try:
+            message = orjson.loads(e.response.content)["error"]["message"]
+        except (httpx.ResponseNotRead, orjson.JSONDecodeError, KeyError, TypeError):
+            return False
+        return "cachedcontent" in str(message).replace(" ", "").lower()
+
     async def chamar_gemini(self, content: Union[str, dict, list], content_type: ContentType = ContentType.TEXT) -> str:
         """Envia uma requisição para a API do Google Gemini e retorna a resposta."""
         if not self.api_key:
             return "Erro: GEMINI_API_KEY não encontrada"
 
-        url = f"https://generativelanguage.googleapis.com/v1/models/{self.config.model.value}:generateContent?key={self.api_key}"
-        
-        headers = {
-            "Content-Type": "application/json"
-        }
+        # O payload é montado antes da URL porque imagens trocam o modelo para o de visão
+        data = self.build_request_data(content, content_type)
+        # Contexto que não vale mais para esta requisição é apagado do servidor
+        if self.cached_content_name and "cachedContent" not in data:
+            await self._drop_cached_content()
+        url = self._build_url(data, "generateContent")
+        body = self._dumps_payload(data)
+
+        cache_key, cached = self._cache_lookup(body)
+        if cached is not None:
+            return cached
 
         try:
-            data = self.build_request_data(content, content_type)
-            response = requests.post(url, headers=headers, json=data)
+            response = await self.client.post(url, content=body)
             response.raise_for_status()
             
-            resposta_json = response.json()
+            resposta_json = orjson.loads(response.content)
             
             if "candidates" in resposta_json:
-                return resposta_json["candidates"][0]["content"]["parts"][0]["text"]
+                resposta = resposta_json["candidates"][0]["content"]["parts"][0]["text"]
+                if cache_key is not None:
+                    self._cache_store(cache_key, resposta)
+                return resposta
             else:
                 return "Erro: Resposta inesperada do Gemini"
                 
-        except requests.exceptions.RequestException as e:
-            if hasattr(e, 'response'):
-                if e.response.status_code == 401:
-                    return "Erro 401: Não autorizado. Verifique sua chave de API."
-                elif e.response.status_code == 404:
-                    return "Erro 404: API não encontrada."
-            return f"Erro na requisição à API Gemini: {str(e)}"
-        except json.JSONDecodeError:
+        except httpx.HTTPError as e:
+            if self._cached_content_rejected(e, data):
+                # Apaga o contexto no servidor e repete a pergunta uma vez com o documento inline
+                await self._drop_cached_content()
+                return await self.chamar_gemini(content, content_type)
+            return self._error_message(e)
+        except orjson.JSONDecodeError:
             return "Erro: Resposta inválida do servidor"
 
+    async def chamar_gemini_stream(self, content: Union[str, dict, list], content_type: ContentType = ContentType.TEXT) -> AsyncIterator[str]:
+        """Envia a requisição via streaming (SSE) e produz os trechos da resposta conforme chegam."""
+        if not self.api_key:
+            yield "Erro: GEMINI_API_KEY não encontrada"
+            return
+
+        data = self.build_request_data(content, content_type)
+        # Contexto que não vale mais para esta requisição é apagado do servidor
+        if self.cached_content_name and "cachedContent" not in data:
+            await self._drop_cached_content()
+        url = self._build_url(data, "streamGenerateContent")
+        body = self._dumps_payload(data)
+
+        cache_key, cached = self._cache_lookup(body)
+        if cached is not None:
+            yield cached
+            return
+
+        trechos = []
+        rejeitado = False
+        try:
+            async with self.client.stream("POST", url, content=body) as response:
+                if response.is_error:
+                    # Lê o corpo do erro para identificar se o cache de contexto foi rejeitado
+                    await response.aread()
+                response.raise_for_status()
+
+                # Cada evento SSE chega como uma linha "data: {...}" com um pedaço da resposta
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    candidates = orjson.loads(line[6:]).get("candidates")
+                    if not candidates:
+                        continue
+                    parts = candidates[0].get("content", {}).get("parts", [])
+                    trecho = "".join(part.get("text", "") for part in parts)
+                    if trecho:
+                        trechos.append(trecho)
+                        yield trecho
+
+        except httpx.HTTPError as e:
+            rejeitado = self._cached_content_rejected(e, data)
+            if not rejeitado:
+                yield self._error_message(e)
+                return
+        except orjson.JSONDecodeError:
+            yield "Erro: Resposta inválida do servidor"
+            return
+
+        if rejeitado:
+            # Apaga o contexto no servidor e repete a pergunta uma vez com o documento inline
+            await self._drop_cached_content()
+            async for trecho in self.chamar_gemini_stream(content, content_type):
+                yield trecho
+            return
+
+        if not trechos:
+            yield "Erro: Resposta inesperada do Gemini"
+        elif cache_key is not None:
+            self._cache_store(cache_key, "".join(trechos))
+
+# Instância compartilhada no processo: o pool de conexões do cliente é reaproveitado
+_API_SINGLETON: Optional[GeminiAPI] = None
+
+def get_api() -> GeminiAPI:
+    """Retorna a instância compartilhada da API, criando-a na primeira chamada."""
+    global _API_SINGLETON
+    if _API_SINGLETON is None:
+        # Carrega as variáveis de ambiente
+        env_path = os.path.join(os.path.dirname(__file__), '.env')
+        load_dotenv(env_path)
+        _API_SINGLETON = GeminiAPI(os.getenv("GEMINI_API_KEY"))
+    return _API_SINGLETON
+
+async def close_api():
+    """Fecha a instância compartilhada; o cliente assíncrono pertence ao event loop atual."""
+    global _API_SINGLETON
+    if _API_SINGLETON is not None:
+        await _API_SINGLETON.aclose()
+        _API_SINGLETON = None
+
+async def exibir_resposta(api: GeminiAPI, content: Union[str, dict, list], content_type: ContentType = ContentType.TEXT):
+    """Imprime a resposta do Gemini no terminal à medida que os trechos chegam."""
+    print("\nGemini: ", end="", flush=True)
+    async for trecho in api.chamar_gemini_stream(content, content_type):
+        print(trecho, end="", flush=True)
+    print()
+
+async def handle_exit(api: GeminiAPI) -> bool:
+    """Encerra o chat."""
+    print("Encerrando chat...")
+    return False
+
+async def handle_config(api: GeminiAPI) -> bool:
+    """Exibe e altera as configurações do modelo."""
+    print("\nConfigurações atuais:")
+    print(f"Modelo: {api.config.model.value}")
+    print(f"Temperatura: {api.config.temperature}")
+    print(f"Top K: {api.config.top_k}")
+    print(f"Top P: {api.config.top_p}")
+    print(f"Max Output Tokens: {api.config.max_output_tokens}")
+    print(f"Stop Sequences: {api.config.stop_sequences}")
+
+    print("\nO que você deseja configurar?")
+    print(f"1. Modelo ({', '.join(model.value for model in GeminiModel)})")
+    print("2. Temperatura (0.0 a 1.0)")
+    print("3. Top K")
+    print("4. Top P")
+    print("5. Max Output Tokens")
+    print("6. Stop Sequences")
+    print("7. Voltar ao chat")
+
+    opcao = input("\nEscolha uma opção (1-7): ")
+
+    if opcao == "1":
+        print("\nModelos disponíveis:")
+        for model in GeminiModel:
+            print(f"- {model.value}")
+        modelo = input("Digite o nome do modelo: ")
+        try:
+            api.update_config(model=GeminiModel(modelo))
+        except ValueError:
+            print("Modelo inválido!")
+    elif opcao == "2":
+        temp = float(input("Digite a temperatura (0.0 a 1.0): "))
+        api.update_config(temperature=temp)
+    elif opcao == "3":
+        top_k = int(input("Digite o valor de Top K (ou 0 para desativar): "))
+        api.update_config(top_k=top_k if top_k > 0 else None)
+    elif opcao == "4":
+        top_p = float(input("Digite o valor de Top P (ou 0 para desativar): "))
+        api.update_config(top_p=top_p if top_p > 0 else None)
+    elif opcao == "5":
+        max_tokens = int(input("Digite o número máximo de tokens (ou 0 para desativar): "))
+        api.update_config(max_output_tokens=max_tokens if max_tokens > 0 else None)
+    elif opcao == "6":
+        sequences = input("Digite as sequências de parada separadas por vírgula (ou enter para limpar): ")
+        api.update_config(stop_sequences=sequences.split(",") if sequences.strip() else [])
+
+    return True
+
+async def handle_file(api: GeminiAPI) -> bool:
+    """Processa um ou mais arquivos e envia o conteúdo ao Gemini."""
+    paths = input("Digite o caminho do arquivo (ou vários, separados por vírgula): ")
+    file_paths = [path.strip() for path in paths.split(",") if path.strip()]
+    missing = [path for path in file_paths if not os.path.exists(path)]
+    if not file_paths or missing:
+        print(f"Arquivo não encontrado! {', '.join(missing)}")
+        return True
+
+    # Um novo envio substitui o documento mantido em cache anteriormente
+    await api.delete_cache()
+
+    print("\nTipos de conteúdo disponíveis:")
+    for content_type in ContentType:
+        print(f"- {content_type.value}")
+
+    content_type_str = input("Digite o tipo de conteúdo (ou enter para autodetectar): ").lower()
+    content_type = ContentType(content_type_str) if content_type_str else None
+
+    try:
+        # A conexão com a API é aquecida em paralelo, mas os arquivos são processados
+        # um de cada vez: o PyMuPDF não pode ser usado por várias threads ao mesmo tempo
+        warmup = asyncio.create_task(api.ensure_connection())
+        try:
+            items = [await api.process_file(file_path, content_type) for file_path in file_paths]
+        finally:
+            await warmup
+
+        if len(items) > 1:
+            # Todos os arquivos seguem em uma única requisição, em vez de uma por arquivo
+            prompt = input("Digite uma pergunta ou instrução sobre os arquivos: ")
+            await exibir_resposta(api, api.build_parts(prompt or "Analise o conteúdo destes arquivos", items))
+            return True
+
+        processed_content = items[0]
+        if isinstance(processed_content, dict) and processed_content.get("type") == "image":
+            prompt = input("Digite uma descrição ou pergunta sobre a imagem: ")
+            processed_content["prompt"] = prompt
+            await exibir_resposta(api, processed_content, ContentType.IMAGE)
+        elif isinstance(processed_content, str) and len(processed_content) >= CACHE_MIN_CHARS and await api.create_cache(processed_content):
+            print("Documento armazenado no cache de contexto; as próximas perguntas irão reutilizá-lo (use 'limpar' para descartá-lo).")
+            prompt = input("Digite uma pergunta sobre o documento: ")
+            await exibir_resposta(api, prompt or "Resuma este documento")
+        else:
+            await exibir_resposta(api, processed_content, content_type or ContentType.TEXT)
+
+    except Exception as e:
+        print(f"Erro ao processar arquivo: {str(e)}")
+
+    return True
+
+async def handle_clear(api: GeminiAPI) -> bool:
+    """Descarta o documento mantido em cache."""
+    await api.delete_cache()
+    print("Documento em cache descartado.")
+    return True
+
+# Comandos do chat; qualquer outra entrada é enviada ao Gemini sem alterações
+COMMANDS = {
+    "sair": handle_exit,
+    "config": handle_config,
+    "arquivo": handle_file,
+    "limpar": handle_clear,
+}
+
 async def main():
-    # Carrega as variáveis de ambiente
-    env_path = os.path.join(os.path.dirname(__file__), '.env')
-    load_dotenv(env_path)
-    
-    # Inicializa a API
-    api = GeminiAPI(os.getenv("GEMINI_API_KEY"))
+    # Reutiliza a API (e suas conexões) já criada neste processo
+    api = get_api()
     
     print("""
 Bem-vindo ao chat avançado com Gemini!
 Comandos disponíveis:
 - 'config': Alterar configurações
 - 'arquivo': Enviar um arquivo (imagem, PDF, código, etc.)
+- 'limpar': Descartar o documento mantido em cache
 - 'sair': Encerrar o chat
     """)
     
-    while True:
-        comando = input("\nVocê (texto/comando): ").lower()
-        
-        if comando == 'sair':
-            print("Encerrando chat...")
-            break
-            
-        elif comando == 'config':
-            print("\nConfigurações atuais:")
-            print(f"Modelo: {api.config.model.value}")
-            print(f"Temperatura: {api.config.temperature}")
-            print(f"Top K: {api.config.top_k}")
-            print(f"Top P: {api.config.top_p}")
-            print(f"Max Output Tokens: {api.config.max_output_tokens}")
-            print(f"Stop Sequences: {api.config.stop_sequences}")
-            
-            print("\nO que você deseja configurar?")
-            print("1. Modelo (gemini-pro, gemini-pro-vision)")
-            print("2. Temperatura (0.0 a 1.0)")
-            print("3. Top K")
-            print("4. Top P")
-            print("5. Max Output Tokens")
-            print("6. Stop Sequences")
-            print("7. Voltar ao chat")
-            
-            opcao = input("\nEscolha uma opção (1-7): ")
-            
-            if opcao == "1":
-                print("\nModelos disponíveis:")
-                for model in GeminiModel:
-                    print(f"- {model.value}")
-                modelo = input("Digite o nome do modelo: ")
-                try:
-                    api.update_config(model=GeminiModel(modelo))
-                except ValueError:
-                    print("Modelo inválido!")
-            elif opcao == "2":
-                temp = float(input("Digite a temperatura (0.0 a 1.0): "))
-                api.update_config(temperature=temp)
-            elif opcao == "3":
-                top_k = int(input("Digite o valor de Top K (ou 0 para desativar): "))
-                api.update_config(top_k=top_k if top_k > 0 else None)
-            elif opcao == "4":
-                top_p = float(input("Digite o valor de Top P (ou 0 para desativar): "))
-                api.update_config(top_p=top_p if top_p > 0 else None)
-            elif opcao == "5":
-                max_tokens = int(input("Digite o número máximo de tokens (ou 0 para desativar): "))
-                api.update_config(max_output_tokens=max_tokens if max_tokens > 0 else None)
-            elif opcao == "6":
-                sequences = input("Digite as sequências de parada separadas por vírgula (ou enter para limpar): ")
-                api.update_config(stop_sequences=sequences.split(",") if sequences.strip() else [])
-            
-            continue
-            
-        elif comando == 'arquivo':
-            file_path = input("Digite o caminho do arquivo: ")
-            if not os.path.exists(file_path):
-                print("Arquivo não encontrado!")
+    # O finally garante que o cache no servidor seja apagado mesmo com Ctrl+C, EOF ou erros
+    try:
+        while True:
+            entrada = input("\nVocê (texto/comando): ")
+
+            handler = COMMANDS.get(entrada.strip().lower())
+            if handler is not None:
+                if not await handler(api):
+                    break
                 continue
-                
-            print("\nTipos de conteúdo disponíveis:")
-            for content_type in ContentType:
-                print(f"- {content_type.value}")
-            
-            content_type_str = input("Digite o tipo de conteúdo (ou enter para autodetectar): ").lower()
-            content_type = ContentType(content_type_str) if content_type_str else None
-            
-            try:
-                processed_content = await api.process_file(file_path, content_type)
-                
-                if isinstance(processed_content, dict) and processed_content.get("type") == "image":
-                    prompt = input("Digite uma descrição ou pergunta sobre a imagem: ")
-                    processed_content["prompt"] = prompt
-                    response = await api.chamar_gemini(processed_content, ContentType.IMAGE)
-                else:
-                    response = await api.chamar_gemini(processed_content, content_type or ContentType.TEXT)
-                
-                print(f"\nGemini: {response}")
-                
-            except Exception as e:
-                print(f"Erro ao processar arquivo: {str(e)}")
-            
-        else:
-            response = await api.chamar_gemini(comando)
-            print(f"\nGemini: {response}")
+
+            # O texto vai como digitado: apenas a identificação de comandos ignora maiúsculas
+            await exibir_resposta(api, entrada)
+    finally:
+        await close_api()
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(main())
\ No newline at end of file